@@ -9,6 +9,8 @@ import sys
 from datetime import datetime, timedelta
 import re
 import time
+import threading
+import multiprocessing
 
 app = Flask(__name__)
 
@@ -26,6 +28,31 @@ CACHE_DURATION = 900
 USER_SESSIONS = {}
 PROCESSED_WEBHOOKS = {}
 
+# --- DEADLINE PER REQUEST ---
+REQUEST_BUDGET = float(os.environ.get("REQUEST_BUDGET") or 8)  # Detik maksimal per webhook
+# deadline_hit dihitung per request; sisanya per penyebab
+METRICS = {'deadline_hit': 0, 'stale_served': 0, 'vendor_skipped': 0, 'batch_partial': 0,
+           'sap_wait_timeout': 0, 'vendor_deadline_skip': 0, 'search_timeout': 0,
+           'coalesced': 0, 'rate_limited': 0}
+REFRESH_THREADS = {}
+STATE_LOCK = threading.Lock()
+
+# --- PENJADWAL PER GRUP (RATE LIMIT & PENGGABUNGAN) ---
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW") or 1.5)      # Detik menunggu pesan susulan dari grup yang sama
+COALESCE_ACTIVE = float(os.environ.get("COALESCE_ACTIVE") or 10)       # Grup dianggap ramai jika ada lookup dalam N detik terakhir
+RATE_LIMIT_CAPACITY = int(os.environ.get("RATE_LIMIT_CAPACITY") or 10)   # Maks. keyword beruntun per grup
+RATE_LIMIT_REFILL = float(os.environ.get("RATE_LIMIT_REFILL") or 0.5)   # Token (keyword) yang terisi kembali per detik
+GROUP_BUCKETS = {}
+GROUP_PENDING = {}
+GROUP_LAST_LOOKUP = {}
+DIGABUNG = object()       # Penanda: pesan ikut dijawab oleh pesan pertama di grup
+
+# --- MODE PENCARIAN MULTI-PROSES (OPSIONAL) ---
+SEARCH_PROCESSES = int(os.environ.get("SEARCH_PROCESSES") or 0)  # 0 = cari di thread request
+SEARCH_TIMEOUT = float(os.environ.get("SEARCH_TIMEOUT") or 10)  # Detik maksimal menunggu proses pencari
+SEARCH_POOL = {'pid': None, 'workers': [], 'sumber': None, 'tertunda': []}
+SEARCH_LOCK = threading.Lock()
+
 # --- VENDOR DATA (EDJS, MD, RAJAWALI) ---
 CACHE_VENDOR = {'EDJS': {}, 'MD': {}, 'RAJAWALI': {}}
 CACHE_VENDOR_TIMESTAMP = {'EDJS': None, 'MD': None, 'RAJAWALI': None}
@@ -140,6 +167,28 @@ GENERIC_ITEMS = ["baut", "bolt", "mur", "nut", "screw", "washer", "ring"]
 def log(message):
     print(f"[LOG] {message}", file=sys.stdout, flush=True)
 
+def sisa_waktu(deadline):
+    """Sisa budget (detik) sebelum deadline. None = tanpa batas."""
+    if deadline is None: return None
+    return max(0.0, deadline - time.time())
+
+def deadline_lewat(deadline):
+    return deadline is not None and time.time() >= deadline
+
+def catat_metrik(nama, jumlah=1):
+    with STATE_LOCK:
+        METRICS[nama] = METRICS.get(nama, 0) + jumlah
+
+def refresh_di_latar(nama, fungsi, *args):
+    """Jalankan refresh cache di thread terpisah, maksimal satu thread per sumber data."""
+    with STATE_LOCK:
+        t = REFRESH_THREADS.get(nama)
+        if t and t.is_alive(): return t
+        t = threading.Thread(target=fungsi, args=args, daemon=True)
+        REFRESH_THREADS[nama] = t
+        t.start()
+        return t
+
 def connect_google_sheet():
     json_creds = os.environ.get("GOOGLE_JSON_KEY")
     try:
@@ -157,8 +206,7 @@ def connect_google_sheet():
         log(f"Error GSheet: {e}")
         return None
 
-def get_vendor_data(sheet_name):
-    global CACHE_VENDOR, CACHE_VENDOR_TIMESTAMP
+def get_vendor_data(sheet_name, deadline=None):
     now = datetime.now()
     
     cached = CACHE_VENDOR.get(sheet_name, {})
@@ -166,6 +214,23 @@ def get_vendor_data(sheet_name):
     
     if cached and cached_ts and (now - cached_ts).total_seconds() < CACHE_DURATION:
         return cached
+
+    if deadline is None:
+        return download_vendor_data(sheet_name)
+
+    # Mode deadline: refresh di belakang, jangan tunggu. Vendor yang masih loading dilewati.
+    refresh_di_latar(sheet_name, download_vendor_data, sheet_name)
+    if cached:
+        catat_metrik('stale_served')
+    else:
+        log(f"⏭️ {sheet_name} masih loading, dilewati.")
+        catat_metrik('vendor_skipped')
+    return cached
+
+def download_vendor_data(sheet_name):
+    global CACHE_VENDOR, CACHE_VENDOR_TIMESTAMP
+    now = datetime.now()
+    cached = CACHE_VENDOR.get(sheet_name, {})
         
     log(f"🔄 Download Data {sheet_name} dari Cloud...")
     try:
@@ -321,12 +386,31 @@ def smart_clean_keyword(text):
             
     return " ".join(final_words)
 
-def get_data_lightweight():
-    global CACHE_DATA, CACHE_TIMESTAMP
+def get_data_lightweight(deadline=None):
     now = datetime.now()
     if CACHE_DATA and CACHE_TIMESTAMP and (now - CACHE_TIMESTAMP).total_seconds() < CACHE_DURATION:
         return CACHE_DATA
 
+    if deadline is None:
+        return download_data_sap()
+
+    # Mode deadline: sajikan data lama selagi refresh jalan di belakang
+    t = refresh_di_latar('SAP', download_data_sap)
+    if CACHE_DATA:
+        catat_metrik('stale_served')
+        return CACHE_DATA
+
+    # Belum ada cache sama sekali: tunggu download, tapi tidak melewati deadline
+    t.join(sisa_waktu(deadline))
+    if t.is_alive():
+        log("⏱️ Deadline habis menunggu data SAP.")
+        catat_metrik('sap_wait_timeout')
+    return CACHE_DATA
+
+def download_data_sap():
+    global CACHE_DATA, CACHE_TIMESTAMP
+    now = datetime.now()
+
     log("🔄 Download Data Baru...")
     try:
         sheet = connect_google_sheet()
@@ -375,8 +459,170 @@ def get_data_lightweight():
         log(f"⚠️ Gagal: {e}")
         return CACHE_DATA
 
-def cari_stok(raw_keyword, page=0, is_batch=False):
-    data = get_data_lightweight()
+def cocok_item_sap(item, q):
+    # Normalisasi dengan membuang nol di depan (lstrip)
+    mat_norm = normalize_pn(item['mat']).lstrip('0')
+    kw_norm, trans_norm = q['kw_norm'], q['trans_norm']
+    
+    if q['is_short_num']:
+        # Exact Match untuk angka pendek tanpa peduli nol di depan
+        return bool(kw_norm) and (kw_norm == mat_norm or trans_norm == mat_norm)
+
+    # DUAL-WORD MATCHING: Cek kata asli ATAU kata terjemahan
+    desc_l = item['desc'].lower()
+    match_desc = all( (q['original_words'][i] in desc_l or q['translated_words'][i] in desc_l) for i in range(len(q['original_words'])) )
+    match_mat = q['kw_search'] in item['mat'].lower() or q['translated_search'] in item['mat'].lower()
+    match_mat_norm = (kw_norm in mat_norm if kw_norm else False) or (trans_norm in mat_norm if trans_norm else False)
+    return match_desc or match_mat or match_mat_norm
+
+def cocok_item_vendor(norm_pn, val, q):
+    mat_norm = norm_pn.lstrip('0')
+    kw_norm, trans_norm = q['kw_norm'], q['trans_norm']
+    
+    if q['is_short_num']:
+        return bool(kw_norm) and (kw_norm == mat_norm or trans_norm == mat_norm)
+
+    desc_l = str(val.get('desc', '')).lower()
+    match_desc = all( (q['original_words'][i] in desc_l or q['translated_words'][i] in desc_l) for i in range(len(q['original_words'])) )
+    match_pn = q['kw_search'] in val['pn'].lower() or q['translated_search'] in val['pn'].lower()
+    match_pn_norm = (kw_norm in mat_norm if kw_norm else False) or (trans_norm in mat_norm if trans_norm else False)
+    return match_desc or match_pn or match_pn_norm
+
+def ambil_data_vendor(clean_k, deadline=None):
+    """Data semua vendor untuk pencarian & display, plus daftar vendor yang dilewati
+    (budget habis atau cache masih loading) supaya jawaban bisa diberi penanda."""
+    skip_vendor = deadline_lewat(deadline)
+    if skip_vendor:
+        log(f"⏱️ Deadline habis, pencarian vendor untuk '{clean_k}' dilewati.")
+        catat_metrik('vendor_deadline_skip')
+    all_vendor_data = {v_sheet: {} if skip_vendor else get_vendor_data(v_sheet, deadline) for v_sheet in VENDOR_SHEETS}
+    vendor_belum = [v_sheet for v_sheet in VENDOR_SHEETS
+                    if skip_vendor or (deadline is not None and not all_vendor_data[v_sheet] and CACHE_VENDOR_TIMESTAMP.get(v_sheet) is None)]
+    return all_vendor_data, vendor_belum
+
+def _search_worker(conn):
+    """Loop proses pencari: simpan shard data, jawab query dengan indeks SAP & kunci vendor yang cocok."""
+    # Tutup descriptor warisan parent (socket gunicorn, pipe proses lain) agar EOF pipe terdeteksi
+    fd = conn.fileno()
+    os.closerange(3, fd)
+    os.closerange(fd + 1, os.sysconf("SC_OPEN_MAX"))
+
+    sap_shard, sap_offset, vendor_shard = [], 0, []
+    while True:
+        try:
+            pesan = conn.recv()
+        except EOFError:
+            return
+        if pesan[0] == 'muat':
+            _, sap_shard, sap_offset, vendor_shard = pesan
+        elif pesan[0] == 'cari':
+            q = pesan[1]
+            idx_sap = [sap_offset + i for i, item in enumerate(sap_shard) if cocok_item_sap(item, q)]
+            kunci_vendor = [] if q['skip_vendor'] else [(v_sheet, norm_pn) for v_sheet, norm_pn, val in vendor_shard if cocok_item_vendor(norm_pn, val, q)]
+            conn.send((idx_sap, kunci_vendor))
+
+def _siapkan_pool():
+    # Hanya dipanggil saat import, sebelum worker gunicorn melayani request & menjalankan thread lain.
+    # Pakai "fork", bukan "forkserver"/"spawn": keduanya meng-import ulang app.py di proses anak,
+    # sehingga sync_kamus() (download Google Sheets) ikut jalan di setiap proses pencari.
+    ctx = multiprocessing.get_context("fork")
+    workers = []
+    for _ in range(SEARCH_PROCESSES):
+        parent_conn, child_conn = ctx.Pipe()
+        p = ctx.Process(target=_search_worker, args=(child_conn,), daemon=True)
+        p.start()
+        child_conn.close()
+        workers.append((p, parent_conn))
+    SEARCH_POOL.update(pid=os.getpid(), workers=workers, sumber=None, tertunda=[0] * len(workers))
+    log(f"⚙️ {SEARCH_PROCESSES} proses pencari siap.")
+
+def _matikan_pool():
+    # Pool tidak dibuat ulang dari thread request (fork di sana tidak aman):
+    # sisa umur worker ini memakai pencarian biasa.
+    for p, conn in SEARCH_POOL['workers']:
+        conn.close()
+        p.terminate()
+    SEARCH_POOL.update(workers=[], sumber=None, tertunda=[])
+    log("⚠️ Proses pencari dimatikan, worker ini kembali ke pencarian biasa.")
+
+def _kosongkan_jawaban_lama(workers, batas):
+    """Buang jawaban query lama yang telat. False = ada proses yang masih sibuk sampai batas."""
+    tertunda = SEARCH_POOL['tertunda']
+    for i, (p, conn) in enumerate(workers):
+        while tertunda[i] > 0:
+            if not conn.poll(max(0, batas - time.time())):
+                if not p.is_alive():
+                    raise RuntimeError("proses pencari mati")
+                return False
+            conn.recv()
+            tertunda[i] -= 1
+    return True
+
+def _muat_shard(workers, data):
+    """Bagi data ke tiap proses. Hanya dikirim ulang kalau cache berganti (sekali per refresh)."""
+    # Bandingkan dengan objek cache, bukan dict hasil getter per request
+    sumber = [data] + [CACHE_VENDOR.get(v, {}) for v in VENDOR_SHEETS]
+    lama = SEARCH_POOL['sumber']
+    if lama and all(a is b for a, b in zip(lama, sumber)):
+        return lama
+
+    vendor_flat = [(v_sheet, norm_pn, val) for v_sheet, v_data in zip(VENDOR_SHEETS, sumber[1:]) for norm_pn, val in v_data.items()]
+    n = len(workers)
+    uk_sap = max(1, (len(data) + n - 1) // n)
+    uk_vendor = max(1, (len(vendor_flat) + n - 1) // n)
+    for i, (_, conn) in enumerate(workers):
+        conn.send(('muat', data[i*uk_sap:(i+1)*uk_sap], i*uk_sap, vendor_flat[i*uk_vendor:(i+1)*uk_vendor]))
+    SEARCH_POOL['sumber'] = sumber
+    log(f"⚙️ Shard dimuat ulang: {len(data)} item SAP, {len(vendor_flat)} item vendor.")
+    return sumber
+
+def cari_paralel(data, q, deadline=None):
+    """Fan-out query ke semua shard lalu gabungkan hasilnya.
+    Mengembalikan (hasil SAP, hasil vendor, data vendor untuk display) atau None = pakai pencarian biasa."""
+    if SEARCH_POOL['pid'] != os.getpid() or not SEARCH_POOL['workers']:
+        return None
+    # Satu batas waktu untuk antre lock, buang jawaban lama, dan menunggu semua shard
+    batas = time.time() + (SEARCH_TIMEOUT if deadline is None else min(SEARCH_TIMEOUT, sisa_waktu(deadline)))
+    if batas <= time.time() or not SEARCH_LOCK.acquire(timeout=batas - time.time()):
+        return None
+    try:
+        workers = SEARCH_POOL['workers']
+        if not workers:
+            return None
+        # Kirim hanya ke proses yang sudah menganggur, supaya send tidak pernah macet
+        if not _kosongkan_jawaban_lama(workers, batas):
+            log("⏱️ Proses pencari masih sibuk dengan query lama, kembali ke mode biasa.")
+            return None
+        sumber = _muat_shard(workers, data)
+        tertunda = SEARCH_POOL['tertunda']
+        for i, (_, conn) in enumerate(workers):
+            conn.send(('cari', q))
+            tertunda[i] += 1
+
+        idx_sap, kunci_vendor = [], []
+        for i, (p, conn) in enumerate(workers):
+            if not conn.poll(max(0, batas - time.time())):
+                if not p.is_alive():
+                    raise RuntimeError("proses pencari mati")
+                # Jawaban telat dibuang oleh _kosongkan_jawaban_lama di query berikutnya
+                log("⏱️ Proses pencari belum selesai, kembali ke mode biasa.")
+                return None
+            i_sap, k_vendor = conn.recv()
+            tertunda[i] -= 1
+            idx_sap += i_sap
+            kunci_vendor += k_vendor
+    except Exception as e:
+        log(f"💥 Pencarian paralel gagal: {e}")
+        _matikan_pool()
+        return None
+    finally:
+        SEARCH_LOCK.release()
+
+    vendor_by_sheet = dict(zip(VENDOR_SHEETS, sumber[1:]))
+    return [data[i] for i in idx_sap], [vendor_by_sheet[v_sheet][norm_pn] for v_sheet, norm_pn in kunci_vendor], vendor_by_sheet
+
+def cari_stok(raw_keyword, page=0, is_batch=False, deadline=None):
+    data = get_data_lightweight(deadline)
     if not data: return "⚠️ Gagal mengambil data server."
     
     clean_k = smart_clean_keyword(raw_keyword)
@@ -391,48 +637,44 @@ def cari_stok(raw_keyword, page=0, is_batch=False):
     translated_search = " ".join(translated_words)
     trans_norm = normalize_pn(translated_search).lstrip('0')
 
-    # PENCARIAN DI SAP
-    hasil = []
-    for item in data:
-        # Normalisasi dengan membuang nol di depan (lstrip)
-        mat_norm = normalize_pn(item['mat']).lstrip('0')
-        kw_norm = kw_search_norm.lstrip('0')
-        
-        if is_short_num:
-            # Exact Match untuk angka pendek tanpa peduli nol di depan
-            if kw_norm and (kw_norm == mat_norm or trans_norm == mat_norm):
-                hasil.append(item)
-        else:
-            # DUAL-WORD MATCHING: Cek kata asli ATAU kata terjemahan
-            match_desc = all( (original_words[i] in item['desc'].lower() or translated_words[i] in item['desc'].lower()) for i in range(len(original_words)) )
-            match_mat = kw_search in item['mat'].lower() or translated_search in item['mat'].lower()
-            match_mat_norm = (kw_norm in mat_norm if kw_norm else False) or (trans_norm in mat_norm if trans_norm else False)
-            
-            if match_desc or match_mat or match_mat_norm:
-                hasil.append(item)
+    q = {
+        'is_short_num': is_short_num,
+        'original_words': original_words,
+        'translated_words': translated_words,
+        'kw_search': kw_search,
+        'translated_search': translated_search,
+        'kw_norm': kw_search_norm.lstrip('0'),
+        'trans_norm': trans_norm,
+        'skip_vendor': False
+    }
+
+    paralel = all_vendor_data = None
+    if SEARCH_PROCESSES > 0:
+        # MODE MULTI-PROSES: SAP & VENDOR dicari sekaligus di semua shard
+        all_vendor_data, vendor_belum = ambil_data_vendor(clean_k, deadline)
+        # Vendor dilewati (deadline/masih loading): shard dibiarkan, proses pencari cukup skip vendor
+        q['skip_vendor'] = not any(all_vendor_data.values())
+        paralel = cari_paralel(data, q, deadline)
+
+    if paralel is not None:
+        hasil, vendor_matches, vendor_shard = paralel
+        if not q['skip_vendor']:
+            # Display pakai data vendor yang sama dengan yang menghasilkan match
+            all_vendor_data = vendor_shard
+    elif SEARCH_PROCESSES > 0 and deadline_lewat(deadline):
+        # Budget sudah habis menunggu proses pencari: jangan lanjut scan penuh di thread ini
+        log(f"⏱️ Pencarian '{clean_k}' dibatalkan, budget habis.")
+        catat_metrik('search_timeout')
+        return f"⏱️ _Pencarian '{clean_k}' belum selesai, coba tanya lagi sebentar._\n"
+    else:
+        # PENCARIAN DI SAP
+        hasil = [item for item in data if cocok_item_sap(item, q)]
 
-    # PENCARIAN DI VENDOR (EDJS, MD, RAJAWALI)
-    vendor_matches = []
-    all_vendor_data = {} # Gabungkan semua data vendor untuk referensi display nanti
-    
-    for v_sheet in VENDOR_SHEETS:
-        v_data = get_vendor_data(v_sheet)
-        all_vendor_data[v_sheet] = v_data
-        
-        for norm_pn, val in v_data.items():
-            mat_norm = norm_pn.lstrip('0')
-            kw_norm = kw_search_norm.lstrip('0')
-            
-            if is_short_num:
-                if kw_norm and (kw_norm == mat_norm or trans_norm == mat_norm):
-                    vendor_matches.append(val)
-            else:
-                match_desc = all( (original_words[i] in str(val.get('desc', '')).lower() or translated_words[i] in str(val.get('desc', '')).lower()) for i in range(len(original_words)) )
-                match_pn = kw_search in val['pn'].lower() or translated_search in val['pn'].lower()
-                match_pn_norm = (kw_norm in mat_norm if kw_norm else False) or (trans_norm in mat_norm if trans_norm else False)
-                
-                if match_desc or match_pn or match_pn_norm:
-                    vendor_matches.append(val)
+        # PENCARIAN DI VENDOR (EDJS, MD, RAJAWALI)
+        # Gabungkan semua data vendor untuk referensi display nanti
+        if all_vendor_data is None:
+            all_vendor_data, vendor_belum = ambil_data_vendor(clean_k, deadline)
+        vendor_matches = [val for v_sheet in VENDOR_SHEETS for norm_pn, val in all_vendor_data[v_sheet].items() if cocok_item_vendor(norm_pn, val, q)]
 
     unik_items = []
     seen = set()
@@ -457,6 +699,9 @@ def cari_stok(raw_keyword, page=0, is_batch=False):
             return "" # Diam jika angka pendek (misal "1000") tidak ada exact match
         if not any(char.isdigit() for char in clean_k) and len(clean_k.replace(" ", "")) < 4:
             return "" # Bot diam (Silent Mode huruf pendek)
+        if vendor_belum:
+            # Jangan jawab "boten wonten" kalau ada vendor yang belum dicek
+            return f"🙏 Stok *'{clean_k}'* belum ketemu di SAP.\n⚠️ _Data vendor {', '.join(vendor_belum)} belum dimuat, coba tanya lagi sebentar._\n"
         return f"🙏 Stok *'{clean_k}'* boten wonten."
 
     total_items = len(unik_items)
@@ -544,6 +789,9 @@ def cari_stok(raw_keyword, page=0, is_batch=False):
 
         pesan += "------------------\n"
 
+    if vendor_belum:
+        pesan += f"⚠️ _Data vendor {', '.join(vendor_belum)} belum dimuat, stok vendor belum lengkap._\n"
+
     if not is_batch:
         if page < total_pages - 1: pesan += "👇 _Ketik *Next* untuk lanjut._\n"
         pesan += f"🕒 {data[0]['last_update'] if data and 'last_update' in data[0] else 'Updated: -'}"
@@ -554,22 +802,25 @@ def cari_stok(raw_keyword, page=0, is_batch=False):
 # 4. PUSAT PEMROSESAN (STRICT LOGIC ENGINE V.4.16)
 # ==========================================
 
-def proses_pesan(message, sender_id):
-    if not message: return None
+def is_pesan_next(message):
+    return bool(message) and message.lower().strip() in ["lagi", "next", "lanjut", "berikutnya"]
+
+def is_part_number(keyword):
+    """Lookup langsung part number (bukan pencarian teks bebas)."""
+    k = keyword.lower().strip()
+    return bool(re.search(r'\d+-[a-zA-Z0-9-]+', k)) or (len(k.split()) == 1 and any(c.isdigit() for c in k))
+
+def ekstrak_keyword(message):
+    """Saring pesan (strict mode) lalu kembalikan daftar keyword. List kosong = bukan untuk bot."""
+    if not message: return []
     
     # Jika ada mention/tag manusia (simbol @), asumsikan pesan bukan untuk bot
     if "@" in message and not any(bot_name in message.lower() for bot_name in ["@laden", "@bot"]):
-        return None
+        return []
         
     msg_l = message.lower().strip()
     words = msg_l.split()
     
-    if msg_l in ["lagi", "next", "lanjut", "berikutnya"]:
-        if sender_id in USER_SESSIONS:
-            s = USER_SESSIONS[sender_id]
-            s['page'] += 1
-            return cari_stok(s['keyword'], page=s['page'])
-    
     has_part_number = bool(re.search(r'\d+-[a-zA-Z0-9-]+', msg_l))
     is_blacklisted = any(w in msg_l for w in HARD_BLACKLIST)
     is_chatty = any(w in words for w in CHATTY_WORDS)
@@ -594,28 +845,124 @@ def proses_pesan(message, sender_id):
             # Lolos untuk pencarian item tunggal di bawah 6 kata
             trigger_found = True
             
-    if trigger_found:
-        clean_msg = re.sub(r'@[a-zA-Z0-9_]+', '', message)
-        
-        for t in ["tanya laden", "tanya den", "cek laden", "cek den", "tanya stok", "cek stok", "tolong cek stok", "cek", "stok", "stock", "laden", "bot", "min", "den", "tolong"]:
-            clean_msg = re.sub(r'\b'+t+r'\b', '', clean_msg, flags=re.IGNORECASE)
-        
-        raw_lines = re.split(r'[\n,]', clean_msg)
-        valid = [smart_clean_keyword(l) for l in raw_lines if len(smart_clean_keyword(l).strip()) > 1]
-        
-        if not valid: return None
-        
-        is_b = len(valid) > 1
-        if not is_b: 
+    if not trigger_found: return []
+
+    clean_msg = re.sub(r'@[a-zA-Z0-9_]+', '', message)
+    
+    for t in ["tanya laden", "tanya den", "cek laden", "cek den", "tanya stok", "cek stok", "tolong cek stok", "cek", "stok", "stock", "laden", "bot", "min", "den", "tolong"]:
+        clean_msg = re.sub(r'\b'+t+r'\b', '', clean_msg, flags=re.IGNORECASE)
+    
+    raw_lines = re.split(r'[\n,]', clean_msg)
+    return [smart_clean_keyword(l) for l in raw_lines if len(smart_clean_keyword(l).strip()) > 1]
+
+def susun_balasan(valid, sender_id, deadline=None):
+    is_b = len(valid) > 1
+    if not is_b: 
+        with STATE_LOCK:
             USER_SESSIONS[sender_id] = {'keyword': valid[0], 'page': 0}
+    
+    reply = "📦 *Hasil Multi-Item:*\n\n" if is_b else ""
+    for i, kw in enumerate(valid):
+        # Multi-item: berhenti kalau budget habis, kirim hasil sebagian + penanda
+        if i > 0 and deadline_lewat(deadline):
+            sisa = valid[i:]
+            reply += f"⏱️ _Hasil sebagian, {len(sisa)} item belum dicek: {', '.join(sisa)}. Silakan tanya ulang._\n"
+            log(f"⏱️ Deadline habis, batch dipotong ({len(sisa)} item tersisa).")
+            catat_metrik('batch_partial')
+            break
+        reply += cari_stok(kw, page=0, is_batch=is_b, deadline=deadline)
         
-        reply = "📦 *Hasil Multi-Item:*\n\n" if is_b else ""
-        for kw in valid: 
-            reply += cari_stok(kw, page=0, is_batch=is_b)
-            
-        return reply
-        
-    return None
+    return reply
+
+def proses_pesan(message, sender_id, deadline=None):
+    if not message: return None
+    
+    if is_pesan_next(message):
+        with STATE_LOCK:
+            s = USER_SESSIONS.get(sender_id)
+            if s:
+                s['page'] += 1
+                keyword, page = s['keyword'], s['page']
+        if s:
+            return cari_stok(keyword, page=page, deadline=deadline)
+    
+    valid = ekstrak_keyword(message)
+    if not valid: return None
+    return susun_balasan(valid, sender_id, deadline)
+
+def ambil_token(sender_id, jumlah):
+    """Token bucket per grup. Mengembalikan jumlah token yang didapat (0 s/d jumlah)."""
+    now = time.time()
+    with STATE_LOCK:
+        b = GROUP_BUCKETS.get(sender_id)
+        if not b:
+            b = GROUP_BUCKETS[sender_id] = {'tokens': float(RATE_LIMIT_CAPACITY), 'ts': now}
+        b['tokens'] = min(RATE_LIMIT_CAPACITY, b['tokens'] + (now - b['ts']) * RATE_LIMIT_REFILL)
+        b['ts'] = now
+        dapat = min(jumlah, int(b['tokens']))
+        b['tokens'] -= dapat
+        return dapat
+
+def jadwalkan_pesan(message, sender_id, deadline=None):
+    """Pesan yang datang hampir bersamaan dari grup yang sama digabung jadi satu pencarian
+    multi-item dan satu balasan. Pesan susulan mengembalikan DIGABUNG."""
+    if is_pesan_next(message) and sender_id in USER_SESSIONS:
+        if not ambil_token(sender_id, 1):
+            catat_metrik('rate_limited')
+            return None
+        return proses_pesan(message, sender_id, deadline)
+
+    valid = ekstrak_keyword(message)
+    if not valid: return None
+
+    now = time.time()
+    with STATE_LOCK:
+        antrean = GROUP_PENDING.get(sender_id)
+        if antrean is not None:
+            antrean['keywords'].extend(valid)
+            antrean['pesan'] += 1
+        else:
+            GROUP_PENDING[sender_id] = {'keywords': list(valid), 'pesan': 1}
+        last = GROUP_LAST_LOOKUP.get(sender_id)
+        GROUP_LAST_LOOKUP[sender_id] = now
+    if antrean is not None:
+        catat_metrik('coalesced')
+        return DIGABUNG
+
+    # Hanya grup yang sedang ramai yang menunggu susulan (maks. setengah sisa budget);
+    # lookup di grup yang sepi langsung dicari tanpa jeda.
+    if last is not None and now - last < COALESCE_ACTIVE:
+        jeda = COALESCE_WINDOW if deadline is None else min(COALESCE_WINDOW, sisa_waktu(deadline) / 2)
+        time.sleep(jeda)
+    with STATE_LOCK:
+        antrean = GROUP_PENDING.pop(sender_id, {'keywords': [], 'pesan': 1})
+
+    # Buang keyword kembar, lookup part number didahulukan dari pencarian teks bebas
+    unik, seen = [], set()
+    for kw in antrean['keywords']:
+        if kw.lower() not in seen:
+            unik.append(kw)
+            seen.add(kw.lower())
+    unik.sort(key=lambda kw: not is_part_number(kw))
+
+    dapat = ambil_token(sender_id, len(unik))
+    if dapat == 0:
+        log(f"🚦 Rate limit {sender_id}: {len(unik)} keyword diabaikan.")
+        catat_metrik('rate_limited', len(unik))
+        return None
+
+    reply = susun_balasan(unik[:dapat], sender_id, deadline)
+    if antrean['pesan'] > 1 and dapat > 1:
+        # Gabungan beberapa pesan dijawab format multi-item: sesi lama dihapus supaya Next tidak salah halaman
+        with STATE_LOCK:
+            USER_SESSIONS.pop(sender_id, None)
+        reply += f"ℹ️ _{antrean['pesan']} pesan digabung: hasil tiap item dipotong maks. 10 dan Next tidak tersedia. Tanya satu item untuk hasil lengkap._\n"
+    ditunda = unik[dapat:]
+    if ditunda:
+        reply += f"🚦 _Terlalu banyak permintaan, {len(ditunda)} item belum dicek: {', '.join(ditunda)}. Coba lagi sebentar._\n"
+        log(f"🚦 Rate limit {sender_id}: {len(ditunda)} keyword ditunda.")
+        catat_metrik('rate_limited', len(ditunda))
+    return reply
 
 # ==========================================
 # 5. SERVER ENDPOINTS
@@ -625,9 +972,15 @@ def proses_pesan(message, sender_id):
 def home(): 
     return "LADEN V.4.16 ACTIVE"
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    with STATE_LOCK:
+        return jsonify(dict(METRICS))
+
 @app.route('/test', methods=['POST'])
 @app.route('/webhook', methods=['POST'])
 def webhook():
+    deadline = time.time() + REQUEST_BUDGET
     data = request.json
     log(f"Raw Webhook Data: {data}")
     if not data: 
@@ -649,11 +1002,13 @@ def webhook():
     current_time = time.time()
     msg_signature = f"{sender}_{msg}"
 
-    if msg_signature in PROCESSED_WEBHOOKS:
-        if current_time - PROCESSED_WEBHOOKS[msg_signature] < 3: # Turunkan jadi 3 detik
-            return jsonify({"reply": "Duplicate ignored"}), 200
-            
-    PROCESSED_WEBHOOKS[msg_signature] = current_time
+    # Cek & catat dalam satu lock supaya kiriman ganda yang bersamaan tidak lolos dua-duanya
+    with STATE_LOCK:
+        is_duplicate = msg_signature in PROCESSED_WEBHOOKS and current_time - PROCESSED_WEBHOOKS[msg_signature] < 3 # Turunkan jadi 3 detik
+        if not is_duplicate:
+            PROCESSED_WEBHOOKS[msg_signature] = current_time
+    if is_duplicate:
+        return jsonify({"reply": "Duplicate ignored"}), 200
     
     jawaban = None
     if msg and msg.strip().lower() == "/updatekamus":
@@ -663,7 +1018,11 @@ def webhook():
         else:
             jawaban = "⚠️ Akses Ditolak.\n\nFitur ini hanya bisa dilakukan oleh Creator.\nSilakan hubungi Creator jika ingin menambahkan sesuatu.\nWA: 081213223016"
     else:
-        jawaban = proses_pesan(msg, sender)
+        jawaban = jadwalkan_pesan(msg, sender, deadline=deadline)
+        if deadline_lewat(deadline):
+            catat_metrik('deadline_hit')
+        if jawaban is DIGABUNG:
+            return jsonify({"reply": "Coalesced"}), 200
     
     if jawaban:
         # if FONNTE_TOKEN and "ISI_TOKEN" not in FONNTE_TOKEN:
@@ -692,7 +1051,7 @@ def webhook():
                         "to": sender,
                         "body": jawaban
                     },
-                    timeout=5
+                    timeout=max(1, min(5, sisa_waktu(deadline)))
                 )
             except Exception as e:
                 log(f"Starsender Send Error: {e}")
@@ -704,5 +1063,12 @@ def webhook():
 # Jalankan sync_kamus otomatis saat di-load oleh Render/Gunicorn
 sync_kamus()
 
+# Proses pencari dibuat saat import, sebelum worker melayani request & menjalankan thread lain
+if SEARCH_PROCESSES > 0:
+    try:
+        _siapkan_pool()
+    except Exception as e:
+        log(f"💥 Gagal menyiapkan proses pencari: {e}")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, threaded=True)